@@ -1,13 +1,63 @@
 import streamlit as st
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 import pandas as pd
 import json
+import orjson
 import re
+import hashlib
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.html
+from lxml import etree
+from bs4 import UnicodeDammit
 import time
-from urllib.parse import urljoin, urlparse
-import math
+import random
+from urllib.parse import urljoin
+import threading
+import os
+import itertools
+from typing import TypedDict
+from google.api_core import exceptions as google_exceptions
+import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from helpers import (
+    RateLimiter, ResponseCache, drop_partial_utf8_tail, is_valid_url, normalize_url, parse_model_json
+)
+
+MAX_SCRAPE_WORKERS = 8
+MAX_CHAR_LIMIT = 20000
+MAX_SCRAPE_BYTES = 1_000_000
+PROGRESS_UPDATE_FRACTION = 0.05
+ANALYSIS_SNIPPET_CHARS = 2000
+STRIP_TAGS = frozenset({"script", "style", "nav", "footer", "header", "aside", "form", "noscript", "svg", "iframe"})
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+MAX_ANALYSIS_WORKERS = 4
+MAX_QUERIES_PER_BATCH = 5
+# Each score carries a gap and a suggestion, so this bounds each analysis response to a few thousand tokens
+MAX_SCORES_PER_BATCH = 40
+# Flash handles query generation and Simple analysis; Pro is reserved for Deep analysis
+GEMINI_FAST_MODEL = "gemini-2.5-flash"
+GEMINI_DEEP_MODEL = "gemini-2.5-pro"
+GEMINI_REQUESTS_PER_MINUTE = 20
+GEMINI_MAX_ATTEMPTS = 4
+GEMINI_MAX_BACKOFF_SECONDS = 30
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_PATH = os.path.join(".cache", "responses.sqlite3")
+# Roughly 4k tokens, the smallest context Gemini 2.5 Pro accepts for explicit caching
+EXPLICIT_CACHE_MIN_CHARS = 16_000
+CONTENT_CACHE_TTL = datetime.timedelta(minutes=10)
+TRANSIENT_GEMINI_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+WHITESPACE_RE = re.compile(r'\s+')
 
 st.set_page_config(page_title="Content Gap Analyzer", layout="wide")
 st.title("🔍 Query-fan-out simulator & Content Analysis")
@@ -28,25 +78,46 @@ if 'gemini_api_key' not in st.session_state:
 
 st.session_state.gemini_api_key = st.sidebar.text_input("🔑 Gemini API Key", type="password", value=st.session_state.gemini_api_key)
 user_query = st.sidebar.text_area("Enter your core topic or keyword", "what is quantum key distribution?", height=120)
-mode = st.sidebar.radio("🔬 Analysis Mode", ["Simple Analysis", "Deep Analysis"], help="Deep Analysis generates more queries for a more thorough investigation.")
+mode = st.sidebar.radio("🔬 Analysis Mode", ["Simple Analysis", "Deep Analysis"], help="Deep Analysis generates more queries and analyzes them with Gemini 2.5 Pro for a more thorough investigation; Simple Analysis uses the faster Gemini 2.5 Flash.")
 
 st.sidebar.markdown("---")
 st.sidebar.subheader("Advanced Scraping Settings")
 char_limit = st.sidebar.slider(
     "Scraping Character Limit per URL",
     min_value=1000,
-    max_value=20000,
-    value=20000,
+    max_value=MAX_CHAR_LIMIT,
+    value=MAX_CHAR_LIMIT,
     step=1000,
     help="Set the maximum number of characters to scrape from each URL. A higher limit provides more context but may increase processing time and cost."
 )
+clear_cached_pages = st.sidebar.button("🧹 Clear Cached Pages", use_container_width=True, help="Scraped pages are reused for an hour. Clear them to refetch pages that have changed.")
 st.sidebar.markdown("---")
 
+GEMINI_CLIENT_CLASSES = {"generative": glm.GenerativeServiceClient, "cache": glm.CacheServiceClient}
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key, service):
+    """Builds one Gemini service client per API key and service, shared by every session using that key.
+
+    genai.configure() sets a single process-wide key, so with several sessions
+    the key of whoever configured last would be used for everyone's calls.
+    """
+    return GEMINI_CLIENT_CLASSES[service](client_options={"api_key": api_key})
+
+def bind_model(model, api_key):
+    """Points a GenerativeModel at `api_key`'s client; it only falls back to the process-wide client when none is set."""
+    model._client = get_gemini_client(api_key, "generative")
+    return model
+
+@st.cache_resource(show_spinner=False)
+def get_model(api_key, model_name):
+    """Builds the model handle once per API key instead of on every rerun."""
+    return bind_model(genai.GenerativeModel(model_name), api_key)
+
 if st.session_state.gemini_api_key:
     try:
-        genai.configure(api_key=st.session_state.gemini_api_key)
-
-        model = genai.GenerativeModel("gemini-2.5-pro")
+        query_model = get_model(st.session_state.gemini_api_key, GEMINI_FAST_MODEL)
+        analysis_model = get_model(st.session_state.gemini_api_key, GEMINI_DEEP_MODEL if mode == "Deep Analysis" else GEMINI_FAST_MODEL)
     except Exception as e:
         st.error(f"Failed to configure Gemini API: {e}")
         st.stop()
@@ -54,198 +125,555 @@ else:
     st.warning("Please enter your Gemini API Key in the sidebar to begin.")
     st.stop()
 
+@st.cache_resource
+def get_rate_limiter(api_key):
+    """Returns one limiter per API key, shared by every session and rerun that uses the key's quota."""
+    return RateLimiter(GEMINI_REQUESTS_PER_MINUTE, burst=MAX_ANALYSIS_WORKERS)
+
+gemini_rate_limiter = get_rate_limiter(st.session_state.gemini_api_key)
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_PATH)
+
+response_cache = get_response_cache()
+
+class ContentGapQuery(TypedDict):
+    query: str
+    type: str
+    search_intent: str
+
+class AnalysisDetails(TypedDict):
+    target_query_count: int
+    reasoning_for_count: str
+    analysis_focus: str
+
+class ContentGapQueryResponse(TypedDict):
+    analysis_details: AnalysisDetails
+    content_gap_queries: list[ContentGapQuery]
+
+class UrlCoverage(TypedDict):
+    url: str
+    coverage_score: int
+    gap_description: str
+    optimization_suggestion: str
+
+class QueryCoverage(TypedDict):
+    query: str
+    analysis_per_url: list[UrlCoverage]
+
+class BatchAnalysisResponse(TypedDict):
+    batch_analysis: list[QueryCoverage]
+
+def keep_schema_keys(data, schema):
+    """Drops top-level keys the response schema does not declare, so caches hold only what is read."""
+    return {key: data[key] for key in schema.__annotations__ if key in data}
+
+QUERY_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=ContentGapQueryResponse
+)
+ANALYSIS_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=BatchAnalysisResponse
+)
+
+# The response shape is enforced by QUERY_GENERATION_CONFIG's schema, so the
+# prompt only carries instructions and no JSON example.
+CONTENT_GAP_QUERY_TEMPLATE = """
+    Act as a research strategist. Generate diverse web search queries for an automated research tool on the topic: "{q}"
+
+    - {query_count_instruction} Each must target a unique angle or sub-topic of the topic.
+    - Cover foundational concepts, technical processes, applications, challenges, and internal comparisons (e.g., different protocols or methods).
+    - Give each query a type (e.g., question_based) and a search intent (e.g., informational).
+    - Deepen the primary topic only: no comparisons with external brands or competitors.
+
+    In analysis_details, set target_query_count to {num_queries}, explain the count for the '{mode}' mode in reasoning_for_count, and summarize the query set's focus in analysis_focus.
+    """
+
 def CONTENT_GAP_QUERY_PROMPT(q, mode):
     num_queries = 10 if mode == "Simple Analysis" else 20
     query_count_instruction = f"Generate exactly {num_queries} queries."
 
-    return f"""
-    Your goal is to act as a research strategist. Given a topic, you will generate a set of sophisticated and diverse web search queries. These queries are for an automated research tool that will synthesize the findings.
-
-    Original Topic: "{q}"
-
-    **Instructions:**
-    1.  **Generate Diverse Queries:** Create a set of queries that break down the original topic into its most important, distinct components.
-    2.  **Number of Queries:** {query_count_instruction}
-    3.  **Avoid Redundancy:** Each query must target a unique angle or sub-topic.
-    4.  **Cover Different Facets:** The queries should cover a range of aspects: foundational concepts, technical processes, applications, challenges, and internal comparisons (e.g., different protocols or methods).
-    5.  **Categorize Each Query:** Provide a type and search intent for each query.
-
-    **IMPORTANT CONSTRAINT:** The goal is to deepen content on the primary topic, not to create competitor comparison articles. Avoid queries that compare the topic with external brands or competitors.
-
-    **Output Format:**
-    Return a single, valid JSON object. Do not add any text before or after the JSON.
-    {{
-        "analysis_details": {{
-            "target_query_count": {num_queries},
-            "reasoning_for_count": "The number of queries is based on the selected '{mode}' to ensure comprehensive topic coverage.",
-            "analysis_focus": "To create a diverse set of queries for comprehensive research, covering foundational concepts, technical details, applications, and challenges."
-        }},
-        "content_gap_queries": [
-            {{
-                "query": "Example query about a specific aspect of the main topic.",
-                "type": "question_based",
-                "search_intent": "informational"
-            }}
-        ]
-    }}
+    return CONTENT_GAP_QUERY_TEMPLATE.format(
+        q=q,
+        mode=mode,
+        num_queries=num_queries,
+        query_count_instruction=query_count_instruction
+    )
+
+class ModelResponseError(ValueError):
+    """Raised when a model response cannot be parsed; keeps the raw text for display."""
+
+    def __init__(self, message, raw_text):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+def read_streamed_text(response, on_chunk=None):
+    """Joins the text of a streamed Gemini response, calling `on_chunk(received, text)` with the running character count and each new piece."""
+    parts = []
+    received = 0
+    for chunk in response:
+        text = chunk.text if chunk.parts else ""
+        parts.append(text)
+        received += len(text)
+        if on_chunk:
+            on_chunk(received, text)
+    return "".join(parts)
+
+def stream_gemini_text(model, prompt, generation_config, on_chunk=None, on_retry=None):
+    """Runs one rate-limited, streamed Gemini call and returns its text.
+
+    Transient API errors (rate limits, overload, timeouts) are retried with
+    jittered exponential backoff; anything else, or the last failure, is raised.
+    `on_retry()` is called before each retried call, so callers can discard text streamed by the failed one.
     """
+    for attempt in range(GEMINI_MAX_ATTEMPTS):
+        if attempt and on_retry:
+            on_retry()
+        gemini_rate_limiter.acquire()
+        try:
+            response = model.generate_content(prompt, generation_config=generation_config, stream=True)
+            return read_streamed_text(response, on_chunk)
+        except TRANSIENT_GEMINI_ERRORS:
+            if attempt == GEMINI_MAX_ATTEMPTS - 1:
+                raise
+            # Full jitter, so workers throttled together don't all come back together
+            time.sleep(random.uniform(1, min(GEMINI_MAX_BACKOFF_SECONDS, 2 ** (attempt + 1))))
+
+def request_content_gap_queries(model, query, mode, on_chunk=None, on_retry=None):
+    """Returns the parsed query-generation response for (query, mode), from the response cache when possible.
+
+    Kept free of Streamlit calls so a cached result is the same data regardless of the session that produced it.
+    The response is streamed through `on_chunk` (see read_streamed_text) and `on_retry` (see stream_gemini_text);
+    cache hits make no calls.
+    """
+    prompt = CONTENT_GAP_QUERY_PROMPT(query, mode)
+    cache_key = response_cache.make_key(prompt, (model.model_name, "queries", mode))
+    data = response_cache.get(cache_key)
+    if data is None:
+        raw_text = stream_gemini_text(model, prompt, QUERY_GENERATION_CONFIG, on_chunk, on_retry)
+        try:
+            data = keep_schema_keys(parse_model_json(raw_text), ContentGapQueryResponse)
+        except ValueError as e:
+            raise ModelResponseError(str(e), raw_text) from e
+        response_cache.set(cache_key, data)
+    return data
 
-def generate_content_gap_queries(query, mode):
+def generate_content_gap_queries(model, query, mode):
     """Calls the Gemini API to generate queries and handles response parsing."""
-    prompt = CONTENT_GAP_QUERY_PROMPT(query, mode)
+    # Show the JSON as it streams in, so the wait is visible from the first token rather than the last
+    preview = st.empty()
+    received_text = []
+
+    def show_partial(received, text):
+        received_text.append(text)
+        preview.code("".join(received_text), language='json')
+
     try:
-        response = model.generate_content(prompt)
-        json_match = re.search(r'```json\s*(\{.*?\})\s*```', response.text, re.DOTALL)
-        if not json_match:
-            json_match = re.search(r'(\{.*?\})', response.text, re.DOTALL)
-        
-        json_text = json_match.group(1)
-        data = json.loads(json_text)
-        
+        data = request_content_gap_queries(model, query, mode, on_chunk=show_partial, on_retry=received_text.clear)
         st.session_state.analysis_details = data.get("analysis_details", {})
         return data.get("content_gap_queries", [])
 
-    except (json.JSONDecodeError, AttributeError) as e:
+    except ModelResponseError as e:
         st.error(f"🔴 Failed to parse response as JSON. Error: {e}")
         st.text("Raw response from model:")
-        st.code(response.text if 'response' in locals() else "N/A", language='text')
+        st.code(e.raw_text, language='text')
         return None
     except Exception as e:
         st.error(f"🔴 An unexpected error occurred during query generation: {e}")
         return None
+    finally:
+        preview.empty()
 
-def scrape_content(url, character_limit):
-    """Scrapes and cleans text content from a URL."""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=15)
+@st.cache_resource
+def get_http_session():
+    """Creates one pooled HTTP session, shared by all scraper threads, that keeps connections alive across reruns.
+
+    Transient server errors and rate limits are retried with a short backoff inside urllib3.
+    """
+    session = requests.Session()
+    retries = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=MAX_SCRAPE_WORKERS, pool_maxsize=MAX_SCRAPE_WORKERS, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(SCRAPE_HEADERS)
+    return session
+
+http_session = get_http_session()
+
+def read_capped(response, max_bytes):
+    """Reads a streamed response body, stopping once `max_bytes` have been received.
+
+    A body cut short may end mid-character; that partial character is dropped.
+    """
+    chunks = []
+    total = 0
+    for chunk in response.iter_content(chunk_size=65536):
+        chunks.append(chunk)
+        total += len(chunk)
+        if total >= max_bytes:
+            return drop_partial_utf8_tail(b"".join(chunks))
+    return b"".join(chunks)
+
+def collect_text(element, max_chars):
+    """Joins an element's text with whitespace collapsed, stopping once `max_chars` characters are collected."""
+    pieces = []
+    total = 0
+    for text in element.itertext():
+        text = WHITESPACE_RE.sub(' ', text).strip()
+        if text:
+            pieces.append(text)
+            total += len(text) + 1
+            if total > max_chars:
+                break
+    return " ".join(pieces)[:max_chars]
+
+def html_to_text(html, max_chars):
+    """Extracts up to `max_chars` of an HTML document's visible text, skipping STRIP_TAGS subtrees and comments.
+
+    When the page marks up its main content (`<main>`, or a single `<article>`), only that is
+    kept, so sidebars and related-post lists don't crowd the page's own text out of the limit.
+    """
+    if not html.strip(): return ""
+
+    # lxml guesses wrongly on pages without a charset declaration, so detect it the way BeautifulSoup does
+    encoding = UnicodeDammit(html, is_html=True).original_encoding
+    root = lxml.html.document_fromstring(html, parser=lxml.html.HTMLParser(encoding=encoding))
+    etree.strip_elements(root, etree.Comment, *STRIP_TAGS, with_tail=False)
+
+    articles = root.findall('.//article')
+    main = root.find('.//main')
+    if main is None and len(articles) == 1:
+        main = articles[0]
+    if main is not None:
+        text = collect_text(main, max_chars)
+        if text:
+            return text
+    return collect_text(root, max_chars)
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def fetch_page_text(url):
+    """Downloads a page and returns its cleaned text, up to MAX_CHAR_LIMIT characters.
+
+    Cached per URL only; callers apply their own character limit, so moving
+    the slider never refetches a page. Failures raise, so they are never cached.
+    """
+    with http_session.get(url, timeout=15, stream=True) as response:
         response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        for element in soup(["script", "style", "nav", "footer", "header", "aside", "form"]):
-            element.decompose()
-        
-        text = soup.get_text(separator=' ', strip=True)
-        return {"url": url, "content": text[:character_limit]}
+        content_type = response.headers.get('Content-Type', '')
+        media_type = content_type.lower()  # media types are case-insensitive, e.g. Text/HTML
+        # Skip PDFs, images and other downloads before reading their bodies; a missing header is given the benefit of the doubt
+        if media_type and 'html' not in media_type and 'xml' not in media_type:
+            raise ValueError(f"Unsupported content type '{content_type}'.")
+        html = read_capped(response, MAX_SCRAPE_BYTES)
     
+    return html_to_text(html, MAX_CHAR_LIMIT)
+
+if clear_cached_pages:
+    fetch_page_text.clear()
+    st.sidebar.success("Cached pages cleared.")
+
+def scrape_content(url, character_limit):
+    """Scrapes and cleans text content from a URL. Safe to call from worker threads."""
+    try:
+        return {"url": url, "content": fetch_page_text(url)[:character_limit]}
     except requests.exceptions.RequestException as e:
-        st.warning(f"Could not scrape {url}: {e}")
-        return {"url": url, "content": f"Error: Failed to retrieve content. {e}"}
+        return {"url": url, "content": f"Error: Failed to retrieve content. {e}", "error": str(e)}
+    except Exception as e:
+        # An exception escaping a worker would resurface in the main thread and abort the whole run
+        return {"url": url, "content": f"Error: Failed to process content. {e}", "error": str(e)}
 
-def analyze_content_gaps_batch(queries_batch, scraped_data, character_limit):
-    """Analyzes content gaps for a batch of queries against multiple URLs."""
-    if not scraped_data: return None
+def scrape_urls(urls, character_limit, on_progress=None):
+    """Scrapes multiple URLs concurrently, returning results in the same order as `urls`.
 
-    content_summary = "\n\n---\n\n".join(
-        [f"CONTENT FROM: {item['url']}\n\n{item['content'][:2000]}..." for item in scraped_data if item['content']]
+    `on_progress(done, total)` fires about every PROGRESS_UPDATE_FRACTION of the list and on
+    the last URL, so long lists don't flood the front end with one update per page.
+    """
+    if not urls: return []
+
+    results = [None] * len(urls)
+    progress_step = max(1, int(len(urls) * PROGRESS_UPDATE_FRACTION))
+    with ThreadPoolExecutor(max_workers=min(MAX_SCRAPE_WORKERS, len(urls))) as executor:
+        futures = {executor.submit(scrape_content, url, character_limit): i for i, url in enumerate(urls)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if on_progress and (done % progress_step == 0 or done == len(urls)):
+                on_progress(done, len(urls))
+    return results
+
+def build_content_summary(scraped_data):
+    """Joins a snippet of each scraped page into the content block shared by every analysis batch."""
+    return "\n\n---\n\n".join(
+        f"CONTENT FROM: {item['url']}\n\n{item['content'][:ANALYSIS_SNIPPET_CHARS]}..." for item in scraped_data if item['content']
     )
-    queries_text = "\n".join([f"- {q['query']}" for q in queries_batch])
 
-    analysis_prompt = f"""
-    You are an expert Content Gap Analyst. Your task is to analyze content from multiple URLs against a list of queries. The content provided was scraped up to the first {character_limit} characters.
+# Static instructions go first and per-call data last, so every batch of a run
+# shares the longest possible prompt prefix for Gemini's implicit context caching.
+ANALYSIS_PROMPT_PREAMBLE = """
+    You are an expert Content Gap Analyst. For each query below, evaluate how well the content from **each** URL covers it.
+    Score every URL for every query, using the URLs exactly as given:
 
+    - **coverage_score (0-10):** 0 means not addressed; 10 means fully covered.
+    - **gap_description:** Be specific. Instead of "information is missing," say "Lacks a step-by-step guide for implementation."
+    - **optimization_suggestion:** Give a concrete action, e.g., "Add a new H2 section titled 'How to set up X'."
+"""
+
+ANALYSIS_CONTENT_TEMPLATE = """
     **URLs AND THEIR CONTENT SNIPPETS:**
+    The content provided was scraped up to the first {character_limit} characters.
+
     {content_summary}
+    """
 
+ANALYSIS_QUERIES_TEMPLATE = """
     **RESEARCH QUERIES TO ANALYZE:**
     {queries_text}
+    """
 
-    **INSTRUCTIONS:**
-    For each query, evaluate how well it is covered by the content from **each** of the provided URLs. Return your analysis as a single, valid JSON object.
+def build_analysis_context(content_summary, character_limit):
+    """Returns the part of the analysis prompt shared by every batch of a run: instructions plus scraped content."""
+    return ANALYSIS_PROMPT_PREAMBLE + ANALYSIS_CONTENT_TEMPLATE.format(
+        character_limit=character_limit,
+        content_summary=content_summary
+    )
 
-    - **coverage_score (0-10):** 0 means not addressed; 10 means fully covered.
-    - **gap_description:** Be specific. Instead of "information is missing," say "Lacks a step-by-step guide for implementation."
-    - **optimization_suggestion:** Give a concrete action, e.g., "Add a new H2 section titled 'How to set up X'."
+class ContentCacheRegistry:
+    """Thread-safe map from an API key's shared analysis context to its Gemini cached content.
 
-    **JSON OUTPUT STRUCTURE:**
-    {{
-      "batch_analysis": [
-        {{
-          "query": "The text of the research query.",
-          "analysis_per_url": [
-            {{
-              "url": "https://example.com/page-a",
-              "coverage_score": 8,
-              "gap_description": "The topic is mentioned, but lacks depth on technical aspects.",
-              "optimization_suggestion": "Expand the section with more technical details and diagrams."
-            }}
-          ]
-        }}
-      ]
-    }}
+    Reruns over the same scrape (the page cache makes that the common case)
+    reuse the existing cache instead of uploading the context again. Entries
+    are keyed by API key as well as content, since a cache is only usable by
+    the project that created it, and are only handed out while at least half
+    their TTL remains, so a run never starts on a cache that could expire
+    under its batches. Creation happens outside the lock; concurrent requests
+    for the same entry wait on the one creation in flight.
     """
-    
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, model, analysis_context, api_key):
+        """Returns cached content holding `analysis_context`, or None when it is below the
+        explicit caching minimum or creation fails; callers then send the context inline."""
+        if len(analysis_context) < EXPLICIT_CACHE_MIN_CHARS: return None
+
+        key = hashlib.sha256(f"{api_key}\n{model.model_name}\n{analysis_context}".encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] - now > self.ttl.total_seconds() / 2:
+                return entry[0]
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = Future()
+                creating = True
+            else:
+                creating = False
+        if not creating:
+            return pending.result()
+
+        cached = None
+        try:
+            gemini_rate_limiter.acquire()
+            request = glm.CreateCachedContentRequest(cached_content=glm.CachedContent(
+                model=model.model_name,
+                contents=[glm.Content(role="user", parts=[glm.Part(text=analysis_context)])],
+                ttl=self.ttl
+            ))
+            cached = get_gemini_client(api_key, "cache").create_cached_content(request)
+        except Exception:
+            pass
+        with self._lock:
+            del self._pending[key]
+            if cached is not None:
+                self._entries[key] = (cached, now + self.ttl.total_seconds())
+        pending.set_result(cached)
+        return cached
+
+@st.cache_resource
+def get_content_caches():
+    return ContentCacheRegistry(CONTENT_CACHE_TTL)
+
+content_caches = get_content_caches()
+
+def analysis_batch_size(num_urls):
+    """Picks how many queries go in one analysis call, so each response stays under MAX_SCORES_PER_BATCH scores.
+
+    Output grows with queries × URLs while the shared input is resent per batch, so
+    batches shrink only as far as needed to keep responses bounded.
+    """
+    return max(1, min(MAX_QUERIES_PER_BATCH, MAX_SCORES_PER_BATCH // max(num_urls, 1)))
+
+def build_analysis_prompts(queries_batch, analysis_context):
+    """Returns a batch's queries-only prompt (sent against cached content) and its full inline prompt."""
+    queries_text = "\n".join(f"- {q['query']}" for q in queries_batch)
+    queries_prompt = ANALYSIS_QUERIES_TEMPLATE.format(queries_text=queries_text)
+    return queries_prompt, analysis_context + queries_prompt
+
+def analysis_cache_key(model, analysis_prompt):
+    return response_cache.make_key(analysis_prompt, (model.model_name, "analysis"))
+
+def analyze_content_gaps_batch(model, queries_batch, content_summary, character_limit, on_chunk=None, cached_model=None):
+    """Analyzes content gaps for a batch of queries against multiple URLs.
+
+    `content_summary` comes from `build_content_summary` and is built once per run.
+    The response is streamed; `on_chunk` is called as in read_streamed_text.
+    With `cached_model` (bound to the run's entry in `content_caches`), only the queries are sent;
+    if a call against the cache fails, the batch falls back to sending the content inline.
+    Runs on worker threads, so instead of calling Streamlit it returns a
+    `(result, issues)` tuple; each issue is a `(level, message, raw_text)` tuple.
+    """
+    if not content_summary: return None, []
+
+    queries_prompt, analysis_prompt = build_analysis_prompts(queries_batch, build_analysis_context(content_summary, character_limit))
+    cache_key = analysis_cache_key(model, analysis_prompt)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached, []
+
+    issues = []
+    raw_text = ""
+
+    def request_analysis_text():
+        nonlocal cached_model
+        if cached_model is not None:
+            try:
+                return stream_gemini_text(cached_model, queries_prompt, ANALYSIS_GENERATION_CONFIG, on_chunk)
+            except Exception as e:
+                # E.g. the cache expired or was deleted; the full prompt doesn't depend on it
+                issues.append(("warning", f"Cached content was unavailable; resending the content inline. Error: {e}", None))
+                cached_model = None
+        return stream_gemini_text(model, analysis_prompt, ANALYSIS_GENERATION_CONFIG, on_chunk)
+
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            response = model.generate_content(analysis_prompt)
-            raw_text = response.text.strip()
-            match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-            if not match: raise ValueError("No valid JSON object found in model's response.")
-            json_text = match.group(0)
-            return json.loads(json_text)
+            raw_text = request_analysis_text()
+            result = keep_schema_keys(parse_model_json(raw_text), BatchAnalysisResponse)
+            response_cache.set(cache_key, result)
+            return result, issues
         except (json.JSONDecodeError, ValueError) as e:
-            st.warning(f"Analysis failed on attempt {attempt + 1}. Retrying... Error: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-            else:
-                st.error(f"Error analyzing batch after {max_retries} attempts. Skipping.")
-                st.code(raw_text, language='text')
-                return None
+            # No backoff here: a malformed reply isn't load-related, and the rate limiter
+            # and stream_gemini_text already pace and back off the calls themselves
+            issues.append(("warning", f"Analysis failed on attempt {attempt + 1}. Retrying... Error: {e}", None))
+            if attempt == max_retries - 1:
+                issues.append(("error", f"Error analyzing batch after {max_retries} attempts. Skipping.", raw_text))
+                return None, issues
         except Exception as e:
-            st.error(f"An unexpected API error during analysis: {e}")
-            return None
+            issues.append(("error", f"An unexpected API error during analysis: {e}", None))
+            return None, issues
+
+def show_issues(issues):
+    """Displays issues collected by a worker thread on the main Streamlit thread."""
+    for level, message, raw_text in issues:
+        if level == "warning":
+            st.warning(message)
+        else:
+            st.error(message)
+        if raw_text:
+            st.code(raw_text, language='text')
+
+@st.cache_data(show_spinner=False)
+def build_queries_frame(queries):
+    """Builds the generated-queries table; cached so reruns that don't change the queries reuse it."""
+    return pd.DataFrame(queries)
+
+def compact_scores(values):
+    """Converts coverage scores to int8 when that is lossless, i.e. every score is a whole number from 0 to 10.
+
+    Anything else (e.g. 7.5) is kept as the model returned it, so the tables agree with the JSON export.
+    """
+    scores = pd.to_numeric(values, errors='coerce').fillna(0)
+    if scores.between(0, 10).all() and (scores % 1 == 0).all():
+        return scores.astype('int8')
+    return scores
+
+@st.cache_data(show_spinner=False)
+def build_results_frames(query_analyses):
+    """Builds the summary, per-URL detail and coverage-by-URL DataFrames from the per-query analyses.
+
+    Cached on the analyses, so reruns that don't touch them (sidebar edits,
+    debug toggles) skip the rebuild. Returns None when nothing is displayable.
+    """
+    # Built column by column rather than as a list of row dicts
+    summary_columns = {name: [] for name in ("Query", "Target for Optimization", "Highest Coverage Score", "Identified Gap", "Optimization Suggestion")}
+    detailed_columns = {name: [] for name in ("Query", "URL Analyzed", "Coverage Score", "Identified Gap", "Optimization Suggestion")}
+
+    for query_analysis in query_analyses:
+        query_text = query_analysis.get('query')
+        analysis_per_url = query_analysis.get('analysis_per_url', [])
+        
+        if not analysis_per_url: continue
+
+        for url_detail in analysis_per_url:
+            detailed_columns["Query"].append(query_text)
+            detailed_columns["URL Analyzed"].append(url_detail.get('url'))
+            detailed_columns["Coverage Score"].append(url_detail.get('coverage_score', 0))
+            detailed_columns["Identified Gap"].append(url_detail.get('gap_description', 'N/A'))
+            detailed_columns["Optimization Suggestion"].append(url_detail.get('optimization_suggestion', 'N/A'))
+
+        best_target = max(analysis_per_url, key=lambda x: x.get('coverage_score', 0))
+        summary_columns["Query"].append(query_text)
+        summary_columns["Target for Optimization"].append(best_target.get('url'))
+        summary_columns["Highest Coverage Score"].append(best_target.get('coverage_score', 0))
+        summary_columns["Identified Gap"].append(best_target.get('gap_description', 'N/A'))
+        summary_columns["Optimization Suggestion"].append(best_target.get('optimization_suggestion', 'N/A'))
+
+    if not summary_columns["Query"]:
+        return None
+
+    summary_df = pd.DataFrame(summary_columns)
+    detailed_df = pd.DataFrame(detailed_columns)
+    # Scores are 0-10 and URLs repeat once per query, so both columns fit much smaller dtypes
+    summary_df["Highest Coverage Score"] = compact_scores(summary_df["Highest Coverage Score"])
+    detailed_df["Coverage Score"] = compact_scores(detailed_df["Coverage Score"])
+    detailed_df["URL Analyzed"] = detailed_df["URL Analyzed"].astype('category')
+    coverage_by_url = (
+        detailed_df.groupby("URL Analyzed", observed=True)["Coverage Score"]
+        .agg(["mean", "min", "max", "count"])
+        .rename(columns={"mean": "Average Score", "min": "Lowest Score", "max": "Highest Score", "count": "Queries Scored"})
+        .sort_values("Average Score", ascending=False)
+        .round({"Average Score": 1})
+    )
+    return summary_df, detailed_df, coverage_by_url
+
+@st.cache_data(show_spinner=False)
+def build_download_payloads(summary_df, detailed_df, query_analyses, analysis_details, query):
+    """Encodes the summary CSV, detailed CSV and full-analysis JSON downloads once per set of results."""
+    summary_csv = summary_df.to_csv(index=False).encode('utf-8')
+    detailed_csv = detailed_df.to_csv(index=False).encode('utf-8')
+    results_json = orjson.dumps(
+        {"query": query, "analysis_details": analysis_details, "analysis": query_analyses},
+        option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    )
+    return summary_csv, detailed_csv, results_json
 
-def process_and_display_results(analysis_results):
+def process_and_display_results(query_analyses):
     """Processes raw analysis data to create final DataFrames and display results."""
     st.header("📊 Content Gap Analysis Results", anchor=False)
-    
-    summary_results = []
-    detailed_results_flat = []
-    all_detailed_analyses = []
-
-    for batch_result in analysis_results:
-        for query_analysis in batch_result.get('batch_analysis', []):
-            all_detailed_analyses.append(query_analysis)
-            query_text = query_analysis.get('query')
-            analysis_per_url = query_analysis.get('analysis_per_url', [])
-            
-            if not analysis_per_url: continue
-
-            for url_detail in analysis_per_url:
-                detailed_results_flat.append({
-                    "Query": query_text,
-                    "URL Analyzed": url_detail.get('url'),
-                    "Coverage Score": url_detail.get('coverage_score', 0),
-                    "Identified Gap": url_detail.get('gap_description', 'N/A'),
-                    "Optimization Suggestion": url_detail.get('optimization_suggestion', 'N/A')
-                })
-
-            best_target = max(analysis_per_url, key=lambda x: x.get('coverage_score', 0))
-            summary_results.append({
-                "Query": query_text,
-                "Target for Optimization": best_target.get('url'),
-                "Highest Coverage Score": best_target.get('coverage_score', 0),
-                "Identified Gap": best_target.get('gap_description', 'N/A'),
-                "Optimization Suggestion": best_target.get('optimization_suggestion', 'N/A')
-            })
-
-    if not summary_results:
+
+    frames = build_results_frames(query_analyses)
+    if frames is None:
         st.warning("Analysis did not return any actionable results to display.")
         return
+    summary_df, detailed_df, coverage_by_url = frames
 
     st.subheader("Summary: Best Page to Optimize per Query", anchor=False)
-    summary_df = pd.DataFrame(summary_results)
     st.dataframe(summary_df, use_container_width=True, hide_index=True)
+
+    st.subheader("Coverage by URL", anchor=False)
+    st.dataframe(coverage_by_url, use_container_width=True)
     
-    summary_csv = summary_df.to_csv(index=False).encode('utf-8')
-    detailed_df = pd.DataFrame(detailed_results_flat)
-    detailed_csv = detailed_df.to_csv(index=False).encode('utf-8')
+    summary_csv, detailed_csv, results_json = build_download_payloads(
+        summary_df, detailed_df, query_analyses, st.session_state.get('analysis_details', {}), user_query
+    )
 
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         st.download_button(
             label="💾 Download Summary Analysis (CSV)",
@@ -262,9 +690,24 @@ def process_and_display_results(analysis_results):
             mime="text/csv",
             use_container_width=True
         )
+    with col3:
+        st.download_button(
+            label="💾 Download Full Analysis (JSON)",
+            data=results_json,
+            file_name=f"content_gap_analysis_{user_query.replace(' ','_')}.json",
+            mime="application/json",
+            use_container_width=True
+        )
     
     with st.expander("🔬 Show Detailed Analysis (All URLs)"):
-        for analysis in all_detailed_analyses:
+        # One query at a time: expander contents are sent on every rerun even while collapsed
+        selected = st.selectbox(
+            "Query",
+            range(len(query_analyses)),
+            format_func=lambda i: query_analyses[i].get('query', 'N/A')
+        )
+        if selected is not None:
+            analysis = query_analyses[selected]
             st.markdown(f"#### Query: {analysis.get('query', 'N/A')}")
             for url_detail in sorted(analysis.get('analysis_per_url', []), key=lambda x: x.get('coverage_score', 0), reverse=True):
                 st.markdown(f"**URL:** `{url_detail.get('url')}`")
@@ -276,16 +719,16 @@ def process_and_display_results(analysis_results):
 
 if 'queries_generated' not in st.session_state: st.session_state.queries_generated = False
 if 'generated_queries' not in st.session_state: st.session_state.generated_queries = []
-if 'analysis_results' not in st.session_state: st.session_state.analysis_results = []
+if 'flat_analyses' not in st.session_state: st.session_state.flat_analyses = []
 
 if st.sidebar.button("🚀 Generate Queries", use_container_width=True):
     with st.spinner("Generating diverse search queries..."):
-        queries = generate_content_gap_queries(user_query, mode)
+        queries = generate_content_gap_queries(query_model, user_query, mode)
     
     if queries:
         st.session_state.generated_queries = queries
         st.session_state.queries_generated = True
-        st.session_state.analysis_results = []
+        st.session_state.flat_analyses = []
         st.success(f"✅ Generated {len(queries)} queries.")
         st.rerun()
     else:
@@ -293,7 +736,7 @@ if st.sidebar.button("🚀 Generate Queries", use_container_width=True):
 
 if st.session_state.queries_generated:
     st.header("📝 Generated Queries", anchor=False)
-    st.dataframe(pd.DataFrame(st.session_state.generated_queries), use_container_width=True, hide_index=True)
+    st.dataframe(build_queries_frame(st.session_state.generated_queries), use_container_width=True, hide_index=True)
     
     st.header("🌐 Enter URLs for Analysis", anchor=False)
     urls_input = st.text_area(
@@ -302,41 +745,97 @@ if st.session_state.queries_generated:
         height=100,
         key="multiple_urls_input"
     )
-    urls_to_process = [url.strip() for url in urls_input.split('\n') if url.strip() and url.startswith('http')]
+    entered_urls = [url for url in map(str.strip, urls_input.splitlines()) if is_valid_url(url)]
+    # The normalized form is only the dedupe key: the first spelling of each URL is what gets scraped and shown
+    first_by_key = {}
+    for url in entered_urls:
+        first_by_key.setdefault(normalize_url(url), url)
+    urls_to_process = list(first_by_key.values())
+    if len(urls_to_process) < len(entered_urls):
+        st.info(f"Skipping {len(entered_urls) - len(urls_to_process)} duplicate URL(s).")
     
     if st.button("🔍 Scrape & Analyze Content", key="scrape_analyze_btn", disabled=not urls_to_process, use_container_width=True):
         with st.status("Running Full Analysis...", expanded=True) as status:
             status.update(label=f"Step 1/3: Scraping content (up to {char_limit} chars/URL)...")
-            scraped_data = [scrape_content(url, char_limit) for url in urls_to_process]
-            time.sleep(1)
+            scraped_data = scrape_urls(
+                urls_to_process,
+                char_limit,
+                on_progress=lambda done, total: status.update(label=f"Step 1/3: Scraped {done}/{total} URLs...")
+            )
+            for item in scraped_data:
+                if item.get('error'):
+                    st.warning(f"Could not scrape {item['url']}: {item['error']}")
             
             status.update(label=f"Step 2/3: Analyzing content against {len(st.session_state.generated_queries)} queries...")
             queries = st.session_state.generated_queries
-            batch_size = 5
-            num_batches = math.ceil(len(queries) / batch_size)
-            
+            batch_size = analysis_batch_size(sum(1 for item in scraped_data if item['content']))
+            batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+            num_batches = len(batches)
+
+            content_summary = build_content_summary(scraped_data)
+            api_key = st.session_state.gemini_api_key
+            analysis_context = build_analysis_context(content_summary, char_limit) if content_summary else None
+            # Only upload the shared context when some batch will actually call the model
+            needs_model = bool(content_summary) and not all(
+                response_cache.contains(analysis_cache_key(analysis_model, build_analysis_prompts(batch, analysis_context)[1]))
+                for batch in batches
+            )
+            content_cache = content_caches.get_or_create(analysis_model, analysis_context, api_key) if needs_model else None
+            cached_model = bind_model(genai.GenerativeModel.from_cached_content(content_cache), api_key) if content_cache else None
             progress_bar = st.progress(0)
-            all_analysis_results = []
-            for i in range(num_batches):
-                start_idx, end_idx = i * batch_size, (i + 1) * batch_size
-                batch_queries = queries[start_idx:end_idx]
-                
-                status.update(label=f"Step 2/3: Analyzing batch {i + 1}/{num_batches}...")
-                batch_results = analyze_content_gaps_batch(batch_queries, scraped_data, char_limit)
-                if batch_results:
-                    all_analysis_results.append(batch_results)
-                
-                progress_bar.progress((i + 1) / num_batches)
-                time.sleep(2)
-
-            st.session_state.analysis_results = all_analysis_results
+            live_results = st.empty()
+            partial_rows = []
+            batch_results = [None] * num_batches
+            received_chars = [0] * num_batches
+
+            def track_received(i):
+                def record_received(count, _text):
+                    received_chars[i] = count
+                return record_received
+
+            with ThreadPoolExecutor(max_workers=MAX_ANALYSIS_WORKERS) as executor:
+                futures = {
+                    executor.submit(
+                        analyze_content_gaps_batch, analysis_model, batch, content_summary, char_limit,
+                        track_received(i), cached_model
+                    ): i
+                    for i, batch in enumerate(batches)
+                }
+                pending = set(futures)
+                done = 0
+                # Poll instead of blocking on as_completed so streamed output shows up between completions
+                while pending:
+                    finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done += 1
+                        result, issues = future.result()
+                        show_issues(issues)
+                        batch_results[futures[future]] = result
+
+                        if result:
+                            partial_rows.extend(
+                                {"Query": analysis.get('query'), "URL Analyzed": url_detail.get('url'), "Coverage Score": url_detail.get('coverage_score', 0)}
+                                for analysis in result.get('batch_analysis', [])
+                                for url_detail in analysis.get('analysis_per_url', [])
+                            )
+                            live_results.dataframe(pd.DataFrame(partial_rows), use_container_width=True, hide_index=True)
+
+                        progress_bar.progress(done / num_batches)
+
+                    status.update(label=f"Step 2/3: Analyzed batch {done}/{num_batches} ({sum(received_chars):,} characters received)...")
+
+            st.session_state.flat_analyses = list(itertools.chain.from_iterable(
+                result.get('batch_analysis', []) for result in batch_results if result
+            ))
             status.update(label="✅ Analysis Complete!", state="complete")
         st.rerun()
 
-if st.session_state.analysis_results:
-    process_and_display_results(st.session_state.analysis_results)
+if st.session_state.flat_analyses:
+    process_and_display_results(st.session_state.flat_analyses)
 
 if st.sidebar.checkbox("Show Debug Info"):
     st.sidebar.subheader("Debug Information")
     with st.sidebar.expander("Session State"):
-        st.json({k: v for k, v in st.session_state.to_dict().items() if k != 'gemini_api_key'})
\ No newline at end of file
+        st.json({k: v for k, v in st.session_state.to_dict().items() if k != 'gemini_api_key'})
+    with st.sidebar.expander("Response Cache"):
+        st.json(response_cache.stats())
\ No newline at end of file
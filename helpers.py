@@ -0,0 +1,227 @@
+"""Helpers for app.py that don't depend on Streamlit, so they can be imported and tested on their own."""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+import orjson
+
+# Query parameters that only track where a click came from; they never change the page served
+TRACKING_PARAM_RE = re.compile(r'^(utm_\w+|gclid|fbclid|msclkid|mc_cid|mc_eid)$', re.IGNORECASE)
+
+class RateLimiter:
+    """Thread-safe token bucket: allows bursts of `burst` calls, then `requests_per_minute` on average."""
+
+    def __init__(self, requests_per_minute, burst):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going negative reserves a future token, so concurrent waiters queue up in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+class ResponseCache:
+    """Thread-safe store of parsed Gemini responses with a time-to-live.
+
+    Whitespace in prompts is collapsed before hashing, so prompts that differ
+    only in layout share an entry; case is kept, since URLs and page text are
+    case-sensitive. The context key keeps prompts that must not alias apart,
+    e.g. the same topic in Simple vs Deep mode. At most `max_entries` are held
+    in memory, least recently used first out. When `path` is given, entries are
+    also written to a SQLite file so they survive restarts; if the file cannot
+    be opened the cache stays memory-only.
+    """
+
+    def __init__(self, ttl_seconds, max_entries, path=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                db = sqlite3.connect(path, check_same_thread=False)
+                db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires_at REAL, value BLOB)")
+                db.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+                db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+                db.commit()
+                self._db = db
+            except (OSError, sqlite3.Error):
+                self._db = None
+
+    @staticmethod
+    def make_key(prompt, context):
+        normalized = " ".join(prompt.split())
+        return hashlib.sha256(repr((context, normalized)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def contains(self, key):
+        """Whether get would return a value, without counting towards the hit/miss stats."""
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries_in_memory": len(self._entries)}
+
+    def set(self, key, value):
+        with self._lock:
+            now = time.time()
+            expires_at = now + self.ttl_seconds
+            for stale_key in [k for k, (entry_expires_at, _) in self._entries.items() if entry_expires_at < now]:
+                del self._entries[stale_key]
+            self._remember(key, (expires_at, value))
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+                    self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, expires_at, orjson.dumps(value)))
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+
+    def _lookup(self, key):
+        """Returns the live value for a key, loading it from SQLite if needed. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            try:
+                row = self._db.execute("SELECT expires_at, value FROM responses WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row:
+                entry = (row[0], orjson.loads(row[1]))
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _remember(self, key, entry):
+        """Stores an entry as most recently used, evicting the oldest past max_entries. Caller holds the lock."""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+def extract_json_text(text):
+    """Returns the first complete JSON object in a model response, e.g. one wrapped in a ```json fence.
+
+    A single forward scan that tracks brace depth and string/escape state, so
+    braces inside string values are ignored and trailing text is never scanned.
+    """
+    start = text.find('{')
+    if start < 0: raise ValueError("No valid JSON object found in model's response.")
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    raise ValueError("No complete JSON object found in model's response.")
+
+def parse_json(text):
+    """Parses JSON with orjson, falling back to the more lenient stdlib parser (e.g. for NaN)."""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+def parse_model_json(text):
+    """Parses a JSON-mode model response, extracting the object only if the model wrapped it anyway.
+
+    Raises ValueError unless the result is a JSON object, so callers report it like any other bad response.
+    """
+    try:
+        data = parse_json(text)
+    except json.JSONDecodeError:
+        data = parse_json(extract_json_text(text))
+    if not isinstance(data, dict):
+        raise ValueError("Model response was not a JSON object.")
+    return data
+
+def drop_partial_utf8_tail(data):
+    """Drops a UTF-8 sequence cut off at the end of `data`, so encoding detection still recognizes the text as UTF-8."""
+    # Walk back over continuation bytes (10xxxxxx) to the start of the last character
+    for i in range(len(data) - 1, max(len(data) - 4, -1), -1):
+        byte = data[i]
+        if byte & 0xC0 != 0x80:
+            if byte >= 0xF0:
+                length = 4
+            elif byte >= 0xE0:
+                length = 3
+            elif byte >= 0xC0:
+                length = 2
+            else:
+                length = 1
+            return data[:i] if len(data) - i < length else data
+    return data
+
+def is_valid_url(url):
+    """Checks that a string is an absolute http(s) URL with a host, so malformed lines are never fetched."""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        # E.g. an unterminated or invalid IPv6 host such as http://[::1
+        return False
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+def normalize_url(url):
+    """Canonicalizes a URL into a deduplication key: lowercase scheme and host, no fragment, no trailing slash,
+    and no tracking parameters (see TRACKING_PARAM_RE).
+
+    The path and query keep their case, since servers may treat them case-sensitively.
+    Only used to compare URLs; the URL as entered is what gets fetched and displayed.
+    """
+    parsed = urlparse(url)
+    query = [(name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True) if not TRACKING_PARAM_RE.match(name)]
+    return parsed._replace(
+        scheme=parsed.scheme.lower(),
+        netloc=parsed.netloc.lower(),
+        path=parsed.path.rstrip('/'),
+        query=urlencode(query),
+        fragment=''
+    ).geturl()
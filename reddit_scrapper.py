@@ -1,13 +1,42 @@
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
-from bs4 import BeautifulSoup
+import html
+from bs4 import BeautifulSoup, SoupStrainer
 from datetime import datetime
 import io
 import time
 from urllib.parse import urlparse
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MAX_REDDIT_WORKERS = 8
+# Request starts are spaced at least this far apart across all workers, to stay polite to Reddit
+MIN_REQUEST_INTERVAL = 0.25
+PAGE_CACHE_TTL_SECONDS = 60 * 60
+
+# Pages are matched as raw bytes and only the captured fragments are decoded; Reddit serves UTF-8
+REDDIT_ENCODING = 'utf-8'
+# The post's details are attributes of its <shreddit-post> tag, so reading that one tag avoids building a DOM.
+# Quoted values are matched whole, since titles may contain '>'.
+SHREDDIT_POST_TAG_RE = re.compile(rb'<shreddit-post\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>', re.IGNORECASE)
+TAG_ATTR_RE = re.compile(r'([\w:-]+)="([^"]*)"')
+# Attributes read from the tag; if any is missing from the regex result, BeautifulSoup reads the tag instead
+SHREDDIT_POST_ATTRS = ('post-title', 'created-timestamp', 'comment-count', 'score')
+STATUS_SPAN_CLASS = 'flex flex-auto flex-col justify-center text-14 pl-sm'
+# Pages without this class anywhere cannot have the archived/locked banner, so they never need a parse for it
+STATUS_SPAN_CLASS_RE = re.compile(rb'class\s*=\s*["\']?\s*flex\s+flex-auto\s+flex-col\s+justify-center\s+text-14\s+pl-sm', re.IGNORECASE)
+# Whole-page patterns used by extract_with_regex when no <shreddit-post> tag was found
+TITLE_ATTR_RE = re.compile(rb'post-title="([^"]*)"')
+COMMENT_COUNT_ATTR_RE = re.compile(rb'comment-count="([^"]*)"')
+SCORE_ATTR_RE = re.compile(rb'score="([^"]*)"')
+REDDIT_DOMAIN_RE = re.compile(r'reddit\.com', re.IGNORECASE)
+# The BeautifulSoup fallback only ever looks up these two elements, so nothing else is built into the tree
+REDDIT_STRAINER = SoupStrainer(['shreddit-post', 'span'])
 
 st.set_page_config(
     page_title="Reddit URL Scraper",
@@ -15,24 +44,179 @@ st.set_page_config(
     layout="wide"
 )
 
-def get_reddit_html(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-    }
-    
+class RequestPacer:
+    """
+    Thread-safe spacing of request start times, so concurrent workers never exceed one start per interval
+    """
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        time.sleep(max(0.0, start - now))
+
+@st.cache_resource
+def get_reddit_pacer():
+    """Returns one pacer shared by every session and rerun, since they all draw on the same reddit.com limits."""
+    return RequestPacer(MIN_REQUEST_INTERVAL)
+
+REDDIT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+@st.cache_resource
+def get_reddit_session():
+    """
+    One keep-alive session shared by all workers and reruns, so repeat requests to reddit.com skip the TLS handshake.
+    Its pool holds a connection per worker, and rate limits and transient server errors are retried with backoff.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=MAX_REDDIT_WORKERS, pool_maxsize=MAX_REDDIT_WORKERS, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(REDDIT_HEADERS)
+    return session
+
+reddit_session = get_reddit_session()
+
+# Fields that are only filled in from a <shreddit-post> tag; all of them missing means the page had no post
+POST_DETAIL_FIELDS = ('reddit_title', 'reddit_posted_time', 'reddit_comments_count', 'reddit_score')
+
+class RedditPostNotFound(Exception):
+    """
+    Raised for a page that loaded but held no post, carrying the details to show for it
+    """
+    def __init__(self, details):
+        super().__init__('No post found on the page')
+        self.details = details
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=4096, show_spinner=False)
+def fetch_reddit_details(url, _pacer):
+    """
+    Fetches and parses a post once per hour per URL, so re-processing the same spreadsheet skips the network.
+    Only the small details dict is cached, never the page itself; failures raise and are therefore never cached.
+    The pacer is left out of the cache key
+    """
+    _pacer.wait()
+    response = reddit_session.get(url, timeout=30)
+    response.raise_for_status()
+    details = extract_reddit_details(response.content)
+    # An empty body or a login/consent interstitial comes back as 200 too; it is retried rather than cached
+    if not response.content or all(details[field] == 'Not found' for field in POST_DETAIL_FIELDS):
+        raise RedditPostNotFound(details)
+    return details
+
+def get_reddit_details(url, pacer, now=None):
+    """
+    Returns the cached details for a URL, with the relative time recomputed so it does not age inside the cache
+    """
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.text
-    except Exception as e:
+        details = dict(fetch_reddit_details(url, pacer))
+    except RedditPostNotFound as e:
+        return e.details
+    except Exception:
+        return extract_reddit_details(None)
+    try:
+        posted = datetime.strptime(details['reddit_posted_time'], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return details
+    details['reddit_time_ago'] = format_time_ago(posted, now)
+    return details
+
+def find_shreddit_post_attrs(html_content):
+    """
+    Reads the attributes of the first <shreddit-post> tag without parsing the page. Returns None unless every
+    attribute in SHREDDIT_POST_ATTRS was found in the usual double-quoted form, so the caller can fall back to
+    BeautifulSoup for anything unusual (single or no quotes, missing attributes)
+    """
+    tag = SHREDDIT_POST_TAG_RE.search(html_content)
+    if not tag:
         return None
+    tag_text = tag.group(0).decode(REDDIT_ENCODING, errors='replace')
+    attrs = {name.lower(): html.unescape(value) for name, value in TAG_ATTR_RE.findall(tag_text)}
+    if not all(name in attrs for name in SHREDDIT_POST_ATTRS):
+        return None
+    return attrs
+
+def parse_reddit_timestamp(timestamp):
+    """
+    Parses a created-timestamp into a naive datetime, keeping the wall-clock time and dropping the offset
+    """
+    # Reddit always sends a fixed-width ISO string (2023-10-03T19:03:52.606000+0000), so read the fields by offset
+    if (len(timestamp) >= 19 and timestamp[10] == 'T' and timestamp[4] == timestamp[7] == '-'
+            and timestamp[13] == timestamp[16] == ':' and timestamp[19:20] in ('', '.', '+', '-', 'Z')):
+        try:
+            return datetime(
+                int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])
+            )
+        except ValueError:
+            pass
+    
+    # Handle different timestamp formats
+    if 'T' in timestamp:
+        # ISO format: 2023-10-03T19:03:52.606000+0000
+        clean_timestamp = timestamp.replace('Z', '+00:00')
+        if '+0000' in clean_timestamp:
+            clean_timestamp = clean_timestamp.replace('+0000', '+00:00')
+        
+        # Remove microseconds if present
+        if '.' in clean_timestamp:
+            base_time, rest = clean_timestamp.split('.')
+            timezone = '+00:00'
+            if '+' in rest:
+                timezone = '+' + rest.split('+')[1]
+            elif '-' in rest:
+                timezone = '-' + rest.split('-')[1]
+            clean_timestamp = base_time + timezone
+        
+        dt = datetime.fromisoformat(clean_timestamp)
+        return dt.replace(tzinfo=None)
+    # Unix timestamp
+    return datetime.fromtimestamp(float(timestamp))
 
-def extract_reddit_details(html_content):
+def format_time_ago(dt, now=None):
+    """
+    Formats the time since dt the way Reddit does, e.g. "3 hr. ago"
+    """
+    if now is None:
+        now = datetime.now()
+    diff = now - dt
+    
+    total_seconds = diff.total_seconds()
+    total_days = diff.days
+    
+    if total_days >= 365:
+        years = math.ceil(total_days / 365)
+        return f"{years} yr. ago"
+    elif total_days >= 30:
+        months = math.ceil(total_days / 30)
+        return f"{months} mo. ago"
+    elif total_days >= 1:
+        return f"{total_days} day{'s' if total_days > 1 else ''} ago"
+    elif total_seconds >= 3600:
+        hours = int(total_seconds // 3600)
+        return f"{hours} hr. ago"
+    elif total_seconds >= 60:
+        minutes = int(total_seconds // 60)
+        return f"{minutes} min. ago"
+    return "now"
+
+def extract_reddit_details(html_content, now=None):
+    """
+    Extracts post details from the raw page bytes fetched by fetch_reddit_details
+    """
     if not html_content:
         return {
             'reddit_title': 'Error: Could not fetch',
@@ -43,8 +227,6 @@ def extract_reddit_details(html_content):
             'reddit_is_archived': 'Error'
         }
     
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
     details = {
         'reddit_title': 'Not found',
         'reddit_posted_time': 'Not found',
@@ -54,7 +236,14 @@ def extract_reddit_details(html_content):
         'reddit_is_archived': 'No'
     }
     
-    shreddit_post = soup.find('shreddit-post')
+    # Fast path reads the tag directly. BeautifulSoup is only built when that fails, or when the page
+    # may carry the status banner, whose nested markup only a real parse reads reliably
+    soup = None
+    shreddit_post = find_shreddit_post_attrs(html_content)
+    if shreddit_post is None or STATUS_SPAN_CLASS_RE.search(html_content):
+        soup = BeautifulSoup(html_content, 'lxml', parse_only=REDDIT_STRAINER)
+    if shreddit_post is None:
+        shreddit_post = soup.find('shreddit-post')
     
     if shreddit_post:
         if shreddit_post.get('post-title'):
@@ -63,55 +252,11 @@ def extract_reddit_details(html_content):
         if shreddit_post.get('created-timestamp'):
             timestamp = shreddit_post.get('created-timestamp')
             try:
-                # Handle different timestamp formats
-                if 'T' in timestamp:
-                    # ISO format: 2023-10-03T19:03:52.606000+0000
-                    clean_timestamp = timestamp.replace('Z', '+00:00')
-                    if '+0000' in clean_timestamp:
-                        clean_timestamp = clean_timestamp.replace('+0000', '+00:00')
-                    
-                    # Remove microseconds if present
-                    if '.' in clean_timestamp:
-                        base_time, rest = clean_timestamp.split('.')
-                        timezone = '+00:00'
-                        if '+' in rest:
-                            timezone = '+' + rest.split('+')[1]
-                        elif '-' in rest:
-                            timezone = '-' + rest.split('-')[1]
-                        clean_timestamp = base_time + timezone
-                    
-                    dt = datetime.fromisoformat(clean_timestamp)
-                    dt = dt.replace(tzinfo=None)
-                else:
-                    # Unix timestamp
-                    dt = datetime.fromtimestamp(float(timestamp))
+                dt = parse_reddit_timestamp(timestamp)
                 
                 details['reddit_posted_time'] = dt.strftime('%Y-%m-%d %H:%M:%S')
                 
-                # Calculate time ago in Reddit format
-                now = datetime.now()
-                diff = now - dt
-                
-                total_seconds = diff.total_seconds()
-                total_days = diff.days
-                
-                if total_days >= 365:
-                    years = math.ceil(total_days / 365)
-                    details['reddit_time_ago'] = f"{years} yr. ago"
-                elif total_days >= 30:
-                    months = math.ceil(total_days / 30)
-                    details['reddit_time_ago'] = f"{months} mo. ago"
-                elif total_days >= 1:
-                    details['reddit_time_ago'] = f"{total_days} day{'s' if total_days > 1 else ''} ago"
-                elif total_seconds >= 3600:
-                    hours = int(total_seconds // 3600)
-                    details['reddit_time_ago'] = f"{hours} hr. ago"
-                elif total_seconds >= 60:
-                    minutes = int(total_seconds // 60)
-                    details['reddit_time_ago'] = f"{minutes} min. ago"
-                else:
-                    details['reddit_time_ago'] = "now"
-                    
+                details['reddit_time_ago'] = format_time_ago(dt, now)
             except Exception:
                 details['reddit_posted_time'] = 'Parse error'
                 details['reddit_time_ago'] = 'Parse error'
@@ -125,7 +270,7 @@ def extract_reddit_details(html_content):
             details['reddit_score'] = shreddit_post.get('score')
     
     # Check if post is archived or locked (robust check for both in the same span)
-    status_span = soup.find('span', class_='flex flex-auto flex-col justify-center text-14 pl-sm')
+    status_span = soup.find('span', class_=STATUS_SPAN_CLASS) if soup is not None else None
     if status_span:
         text = status_span.get_text().lower()
         if 'archived post' in text or 'locked post' in text:
@@ -140,30 +285,28 @@ def extract_reddit_details(html_content):
 
 def extract_with_regex(html_content):
     """
-    Fallback method using regex to extract details
+    Fallback method using regex to extract details from the raw page bytes
     """
     details = {}
     
     # Extract title using regex
-    title_match = re.search(r'post-title="([^"]*)"', html_content)
+    title_match = TITLE_ATTR_RE.search(html_content)
     if title_match:
-        details['reddit_title'] = title_match.group(1)
+        details['reddit_title'] = title_match.group(1).decode(REDDIT_ENCODING, errors='replace')
     
     # Extract comments count
-    comments_match = re.search(r'comment-count="([^"]*)"', html_content)
+    comments_match = COMMENT_COUNT_ATTR_RE.search(html_content)
     if comments_match:
-        details['reddit_comments_count'] = comments_match.group(1)
+        details['reddit_comments_count'] = comments_match.group(1).decode(REDDIT_ENCODING, errors='replace')
     
     # Extract score
-    score_match = re.search(r'score="([^"]*)"', html_content)
+    score_match = SCORE_ATTR_RE.search(html_content)
     if score_match:
-        details['reddit_score'] = score_match.group(1)
+        details['reddit_score'] = score_match.group(1).decode(REDDIT_ENCODING, errors='replace')
     
-    # Check archived status
-    if 'Archived post.' in html_content:
-        details['reddit_is_archived'] = 'Yes'
-    # Check locked status (treat as archived)
-    if re.search(r'locked', html_content, re.IGNORECASE):
+    # Check archived status, then locked status (treated as archived) only if still needed;
+    # a plain substring test on the lowered page is much cheaper than a case-insensitive regex
+    if b'Archived post.' in html_content or b'locked' in html_content.lower():
         details['reddit_is_archived'] = 'Yes'
     
     return details
@@ -172,33 +315,46 @@ def is_reddit_url(url):
     """
     Check if URL contains reddit.com
     """
-    if pd.isna(url) or not isinstance(url, str):
-        return False
-    return 'reddit.com' in url.lower()
+    # Missing values are never strings, so the type check covers them too
+    return isinstance(url, str) and REDDIT_DOMAIN_RE.search(url) is not None
+
+def find_reddit_urls(column):
+    """
+    Boolean mask of the cells in a column that contain reddit.com, without converting the column to strings
+    """
+    try:
+        return column.str.contains(REDDIT_DOMAIN_RE, na=False)
+    except (AttributeError, TypeError):
+        # Object or category column holding no strings at all (e.g. only numbers or booleans)
+        return pd.Series(False, index=column.index)
 
 def identify_reddit_columns(df):
     """
     Identify columns that contain Reddit URLs
     """
     reddit_columns = []
+    total_rows = len(df)
     
-    for col in df.columns:
+    # Only text columns can hold URLs, so numeric and date columns are never converted to strings.
+    # Category columns are included since a column of repeated URLs is often stored that way
+    for col in df.select_dtypes(include=['object', 'string', 'category']).columns:
         # Check if any cell in this column contains reddit.com
-        reddit_count = df[col].astype(str).str.contains('reddit.com', case=False, na=False).sum()
+        reddit_mask = find_reddit_urls(df[col])
+        reddit_count = reddit_mask.sum()
         if reddit_count > 0:
             reddit_columns.append({
                 'column': col,
                 'reddit_urls': reddit_count,
-                'total_rows': len(df)
+                'total_rows': total_rows,
+                'reddit_mask': reddit_mask
             })
     
     return reddit_columns
 
-def process_single_reddit_url(args):
+def process_single_reddit_url(args, pacer, now=None):
     """Helper to process a single Reddit URL for multithreading."""
     row_idx, url = args
-    html_content = get_reddit_html(url)
-    details = extract_reddit_details(html_content)
+    details = get_reddit_details(url, pacer, now=now)
     # Map to new, more descriptive column names
     mapped_details = {
         'Post Title': details.get('reddit_title', ''),
@@ -210,7 +366,7 @@ def process_single_reddit_url(args):
     }
     return row_idx, mapped_details
 
-def process_reddit_urls(df, url_column, progress_bar=None, status_text=None):
+def process_reddit_urls(df, url_column, progress_bar=None, status_text=None, reddit_mask=None):
     new_columns = [
         'Post Title',
         'Posted Date & Time',
@@ -221,29 +377,32 @@ def process_reddit_urls(df, url_column, progress_bar=None, status_text=None):
     ]
     for col in new_columns:
         df[col] = 'Not processed'
-    reddit_urls = df[df[url_column].astype(str).str.contains('reddit.com', case=False, na=False)]
+    # The mask found by identify_reddit_columns is reused when given, rather than scanning the column again
+    if reddit_mask is None:
+        reddit_mask = find_reddit_urls(df[url_column])
+    reddit_urls = df.loc[reddit_mask, url_column]
     total_reddit_urls = len(reddit_urls)
     if total_reddit_urls == 0:
         return df
-    for idx, (row_idx, row) in enumerate(reddit_urls.iterrows()):
-        url = row[url_column]
-        if status_text:
-            status_text.text(f"Processing URL {idx + 1}/{total_reddit_urls}: {url[:50]}...")
-        if progress_bar:
-            progress_bar.progress((idx + 1) / total_reddit_urls)
-        html_content = get_reddit_html(url)
-        details = extract_reddit_details(html_content)
-        mapped_details = {
-            'Post Title': details.get('reddit_title', ''),
-            'Posted Date & Time': details.get('reddit_posted_time', ''),
-            'Posted (Relative)': details.get('reddit_time_ago', ''),
-            'Total Comments': details.get('reddit_comments_count', ''),
-            'Total Upvotes': details.get('reddit_score', ''),
-            'Archived/Locked': details.get('reddit_is_archived', '')
-        }
-        for detail_key, detail_value in mapped_details.items():
-            df.at[row_idx, detail_key] = detail_value
-        time.sleep(1)
+    tasks = list(zip(reddit_urls.index, reddit_urls))
+    # One reference time for the whole batch, so every "time ago" is measured from the same moment
+    now = datetime.now()
+    pacer = get_reddit_pacer()
+    # Workers only fetch and parse; results are collected and progress is shown here on the main thread
+    row_indices = []
+    results = []
+    with ThreadPoolExecutor(max_workers=min(MAX_REDDIT_WORKERS, total_reddit_urls)) as executor:
+        futures = {executor.submit(process_single_reddit_url, task, pacer, now): task[1] for task in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            row_idx, mapped_details = future.result()
+            row_indices.append(row_idx)
+            results.append(mapped_details)
+            if status_text:
+                status_text.text(f"Processed URL {done}/{total_reddit_urls}: {futures[future][:50]}...")
+            if progress_bar:
+                progress_bar.progress(done / total_reddit_urls)
+    # One aligned block write instead of a df.at lookup per cell
+    df.loc[row_indices, new_columns] = pd.DataFrame(results, index=row_indices, columns=new_columns)
     return df
 
 def main():
@@ -266,6 +425,8 @@ def main():
     - Score/Votes
     - Archived Status
     """)
+    if st.sidebar.button("🧹 Clear Cached Posts", use_container_width=True, help="Fetched Reddit post details are reused for an hour. Clear them to refetch posts that have changed."):
+        fetch_reddit_details.clear()
     
     # File upload
     st.header("📁 Upload File")
@@ -281,7 +442,12 @@ def main():
             if uploaded_file.name.endswith('.csv'):
                 df = pd.read_csv(uploaded_file)
             else:
-                df = pd.read_excel(uploaded_file)
+                # The Rust-based calamine reader is much faster than openpyxl on large workbooks
+                try:
+                    df = pd.read_excel(uploaded_file, engine='calamine')
+                except ImportError:
+                    uploaded_file.seek(0)
+                    df = pd.read_excel(uploaded_file)
             
             st.success(f"✅ File uploaded successfully! Shape: {df.shape}")
             
@@ -297,8 +463,7 @@ def main():
                 st.info("You can manually enter a Reddit URL below to extract its details.")
                 manual_url = st.text_input("Enter a Reddit URL to process:", "https://www.reddit.com/r/Python/comments/xxxxxx/example_post/")
                 if st.button("Process Reddit URL"):
-                    html_content = get_reddit_html(manual_url)
-                    details = extract_reddit_details(html_content)
+                    details = get_reddit_details(manual_url, get_reddit_pacer())
                     st.subheader("Extracted Reddit Post Details")
                     st.json(details)
                 return
@@ -315,11 +480,13 @@ def main():
                 
                 # Process the URLs
                 try:
+                    # df is re-read from the upload on every rerun and only gains new columns, so no copy is needed
                     processed_df = process_reddit_urls(
-                        df.copy(), 
+                        df, 
                         reddit_columns[0]['column'], 
                         progress_bar, 
-                        status_text
+                        status_text,
+                        reddit_columns[0]['reddit_mask']
                     )
                     
                     end_time = time.time()
@@ -337,9 +504,9 @@ def main():
                     # Download section
                     st.header("💾 Download Results")
                     
-                    # Convert to CSV for download
-                    csv_buffer = io.StringIO()
-                    processed_df.to_csv(csv_buffer, index=False)
+                    # Convert to CSV for download, encoding straight into bytes so there is no intermediate str
+                    csv_buffer = io.BytesIO()
+                    processed_df.to_csv(csv_buffer, index=False, encoding='utf-8')
                     csv_data = csv_buffer.getvalue()
                     
                     # Create filename
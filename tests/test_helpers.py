@@ -0,0 +1,147 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from helpers import (
+    RateLimiter, ResponseCache, drop_partial_utf8_tail, extract_json_text, is_valid_url, normalize_url,
+    parse_model_json
+)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(60, max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expired_entries_miss_and_are_pruned_on_set(self):
+        cache = ResponseCache(60, max_entries=10)
+        with mock.patch('helpers.time.time', return_value=1000.0):
+            cache.set('old', 1)
+        with mock.patch('helpers.time.time', return_value=1100.0):
+            self.assertIsNone(cache.get('old'))
+            cache.set('other', 2)
+            cache.set('new', 3)
+        self.assertEqual(list(cache._entries), ['other', 'new'])
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_contains_does_not_count_towards_stats(self):
+        cache = ResponseCache(60, max_entries=10)
+        cache.set('a', 1)
+        self.assertTrue(cache.contains('a'))
+        self.assertFalse(cache.contains('b'))
+        self.assertEqual(cache.stats()['hits'], 0)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+    def test_entries_survive_a_new_instance(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'responses.sqlite3')
+            ResponseCache(60, max_entries=10, path=path).set('a', {'x': [1, 2]})
+            self.assertEqual(ResponseCache(60, max_entries=10, path=path).get('a'), {'x': [1, 2]})
+
+    def test_unwritable_path_falls_back_to_memory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            blocker = os.path.join(tmp, 'file')
+            with open(blocker, 'w') as f:
+                f.write('not a directory')
+            cache = ResponseCache(60, max_entries=10, path=os.path.join(blocker, 'responses.sqlite3'))
+            cache.set('a', 1)
+            self.assertEqual(cache.get('a'), 1)
+
+    def test_corrupt_database_falls_back_to_memory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'responses.sqlite3')
+            with open(path, 'w') as f:
+                f.write('not a database' * 100)
+            cache = ResponseCache(60, max_entries=10, path=path)
+            cache.set('a', 1)
+            self.assertEqual(cache.get('a'), 1)
+
+    def test_make_key_collapses_whitespace_but_keeps_case(self):
+        self.assertEqual(ResponseCache.make_key('a  b\nc', 'ctx'), ResponseCache.make_key('a b c', 'ctx'))
+        self.assertNotEqual(ResponseCache.make_key('https://x.com/A', 'ctx'), ResponseCache.make_key('https://x.com/a', 'ctx'))
+        self.assertNotEqual(ResponseCache.make_key('a', 'Simple'), ResponseCache.make_key('a', 'Deep'))
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_waits_once_the_burst_is_spent(self):
+        with mock.patch('helpers.time.monotonic', return_value=0.0), mock.patch('helpers.time.sleep') as sleep:
+            limiter = RateLimiter(60, burst=2)
+            limiter.acquire()
+            limiter.acquire()
+            sleep.assert_not_called()
+            limiter.acquire()
+            limiter.acquire()
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1.0, 2.0])
+
+    def test_tokens_refill_over_time(self):
+        with mock.patch('helpers.time.sleep') as sleep:
+            with mock.patch('helpers.time.monotonic', return_value=0.0):
+                limiter = RateLimiter(60, burst=1)
+                limiter.acquire()
+            with mock.patch('helpers.time.monotonic', return_value=1.0):
+                limiter.acquire()
+        sleep.assert_not_called()
+
+
+class ExtractJsonTextTest(unittest.TestCase):
+    def test_ignores_braces_and_escaped_quotes_inside_strings(self):
+        text = 'Here: {"a": "x } \\" {", "b": {"c": 1}} trailing }'
+        self.assertEqual(extract_json_text(text), '{"a": "x } \\" {", "b": {"c": 1}}')
+
+    def test_reads_fenced_object(self):
+        self.assertEqual(extract_json_text('```json\n{"a": 1}\n```'), '{"a": 1}')
+
+    def test_rejects_missing_or_unterminated_object(self):
+        with self.assertRaises(ValueError):
+            extract_json_text('no json here')
+        with self.assertRaises(ValueError):
+            extract_json_text('{"a": {"b": 1}')
+
+
+class ParseModelJsonTest(unittest.TestCase):
+    def test_extracts_wrapped_object(self):
+        self.assertEqual(parse_model_json('Sure:\n```json\n{"a": 1}\n```'), {'a': 1})
+
+    def test_rejects_json_that_is_not_an_object(self):
+        for text in ('[1, 2]', '"text"', 'null'):
+            with self.assertRaises(ValueError):
+                parse_model_json(text)
+
+
+class DropPartialUtf8TailTest(unittest.TestCase):
+    def test_drops_truncated_multibyte_character(self):
+        for char in ('é', '€', '😀'):
+            encoded = ('ab' + char).encode('utf-8')
+            for cut in range(1, len(char.encode('utf-8'))):
+                self.assertEqual(drop_partial_utf8_tail(encoded[:-cut]), b'ab')
+
+    def test_keeps_complete_text(self):
+        for text in ('', 'abc', 'café', 'a😀'):
+            self.assertEqual(drop_partial_utf8_tail(text.encode('utf-8')), text.encode('utf-8'))
+
+
+class UrlTest(unittest.TestCase):
+    def test_normalize_url_drops_tracking_params_and_fragment(self):
+        self.assertEqual(
+            normalize_url('HTTPS://Example.com/Path/?utm_source=news&id=3&fbclid=abc#section'),
+            'https://example.com/Path?id=3'
+        )
+
+    def test_normalize_url_keeps_path_and_query_case(self):
+        self.assertNotEqual(normalize_url('https://example.com/Path?q=A'), normalize_url('https://example.com/path?q=a'))
+
+    def test_is_valid_url_rejects_malformed_lines(self):
+        self.assertTrue(is_valid_url('https://example.com/x'))
+        for url in ('example.com', 'ftp://example.com', 'http://[bad]/x', 'http://[::1'):
+            self.assertFalse(is_valid_url(url))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from datetime import datetime
+
+import pandas as pd
+
+from reddit_scrapper import extract_reddit_details, format_time_ago, identify_reddit_columns
+
+NOW = datetime(2024, 1, 2)
+POST_TAG = (
+    '<shreddit-post post-title="A post" created-timestamp="2024-01-01T00:00:00.000000+0000" '
+    'comment-count="3" score="5"></shreddit-post>'
+)
+STATUS_CLASS = 'flex flex-auto flex-col justify-center text-14 pl-sm'
+
+
+def details_for(html):
+    return extract_reddit_details(html.encode('utf-8'), now=NOW)
+
+
+class ExtractRedditDetailsTest(unittest.TestCase):
+    def test_reads_post_attributes(self):
+        details = details_for(POST_TAG)
+        self.assertEqual(details['reddit_title'], 'A post')
+        self.assertEqual(details['reddit_posted_time'], '2024-01-01 00:00:00')
+        self.assertEqual(details['reddit_time_ago'], '1 day ago')
+        self.assertEqual(details['reddit_comments_count'], '3')
+        self.assertEqual(details['reddit_score'], '5')
+        self.assertEqual(details['reddit_is_archived'], 'No')
+
+    def test_status_span_with_attribute_before_class(self):
+        details = details_for(POST_TAG + f'<span id="status" class="{STATUS_CLASS}">Archived post. New comments cannot be posted</span>')
+        self.assertEqual(details['reddit_is_archived'], 'Yes')
+
+    def test_status_span_with_nested_icon_span(self):
+        details = details_for(POST_TAG + f'<span class="{STATUS_CLASS}"><span class="icon"><svg></svg></span>Locked post. No new comments</span>')
+        self.assertEqual(details['reddit_is_archived'], 'Yes')
+
+    def test_single_quoted_post_title(self):
+        details = details_for(
+            "<shreddit-post post-title='Single quoted' created-timestamp=\"2024-01-01T00:00:00.000000+0000\" "
+            "comment-count=\"3\" score=\"5\"></shreddit-post>"
+        )
+        self.assertEqual(details['reddit_title'], 'Single quoted')
+        self.assertEqual(details['reddit_score'], '5')
+
+
+class FormatTimeAgoTest(unittest.TestCase):
+    def test_uses_reddit_units(self):
+        self.assertEqual(format_time_ago(datetime(2024, 1, 1, 21), now=NOW), '3 hr. ago')
+        self.assertEqual(format_time_ago(datetime(2023, 11, 1), now=NOW), '3 mo. ago')
+        self.assertEqual(format_time_ago(NOW, now=NOW), 'now')
+
+
+class IdentifyRedditColumnsTest(unittest.TestCase):
+    def test_finds_urls_in_category_column(self):
+        df = pd.DataFrame({
+            'link': pd.Series(['https://www.reddit.com/r/x/comments/1/p/', 'https://example.com', None], dtype='category'),
+            'codes': pd.Series([1, 2, 1], dtype='category'),
+        })
+        columns = identify_reddit_columns(df)
+        self.assertEqual([c['column'] for c in columns], ['link'])
+        self.assertEqual(columns[0]['reddit_mask'].tolist(), [True, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()